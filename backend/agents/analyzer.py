@@ -1,7 +1,8 @@
 # backend/agents/analyzer.py
 
-import json
+import orjson
 import os
+from collections import Counter
 from datetime import datetime
 from typing import List, Dict
 import logging
@@ -10,7 +11,57 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Raw attempt status -> outcome bucket; anything else is "OTHER"
+_OUTCOMES = {
+    "ERROR": "ERROR",
+    "TIMEOUT": "ERROR",
+    "WIN": "WIN",
+    "LOSE": "LOSE"
+}
+
+_REC_HIGH_ERRORS = (
+    "High error rate detected. Consider increasing timeouts "
+    "and improving wait conditions."
+)
+_REC_HIGH_FLAKY = (
+    "High flaky rate detected. Game behavior may be non-deterministic "
+    "or tests may have timing issues."
+)
+_REC_FAILURES = (
+    "Failing tests detected. Review artifacts and triage notes "
+    "for potential bugs."
+)
+_REC_ALL_PASSED = "All tests passed. Consider adding more edge or stress tests."
+
+_BOTH_FAILED = ("ERROR", 0.0, "Both attempts failed to execute", False)
+_ONE_FAILED = ("FLAKY", 0.5, "One attempt failed, one succeeded", False)
+_INCONSISTENT = ("FLAKY", 0.0, "Inconsistent results: {s1} vs {s2}", False)
+
+
 class AnalyzerAgent:
+    # (outcome1, outcome2) -> (verdict, score, notes, check content hash)
+    # Scores of consistent outcomes are set by the hash check.
+    _VERDICT_TABLE = {
+        ("ERROR", "ERROR"): _BOTH_FAILED,
+        ("ERROR", "WIN"): _ONE_FAILED,
+        ("ERROR", "LOSE"): _ONE_FAILED,
+        ("ERROR", "OTHER"): _ONE_FAILED,
+        ("WIN", "ERROR"): _ONE_FAILED,
+        ("LOSE", "ERROR"): _ONE_FAILED,
+        ("OTHER", "ERROR"): _ONE_FAILED,
+        ("WIN", "WIN"): ("PASS", 0.0, "Test passed consistently", True),
+        ("LOSE", "LOSE"): ("FAIL", 0.0, "Test failed consistently", True),
+        ("OTHER", "OTHER"): (
+            "ERROR", 0.0, "Consistent but invalid outcome", True
+        ),
+        ("WIN", "LOSE"): _INCONSISTENT,
+        ("WIN", "OTHER"): _INCONSISTENT,
+        ("LOSE", "WIN"): _INCONSISTENT,
+        ("LOSE", "OTHER"): _INCONSISTENT,
+        ("OTHER", "WIN"): _INCONSISTENT,
+        ("OTHER", "LOSE"): _INCONSISTENT,
+    }
+
     def __init__(self, reports_dir: str = "backend/reports"):
         self.reports_dir = reports_dir
         os.makedirs(self.reports_dir, exist_ok=True)
@@ -24,9 +75,11 @@ class AnalyzerAgent:
         logger.info(f"Analyzing {len(test_results)} test results")
 
         validated_results = []
+        validate = self._validate_test
+        append = validated_results.append
         for result in test_results:
-            verdict_info = self._validate_test(result)
-            validated_results.append({
+            verdict_info = validate(result)
+            append({
                 **result,
                 "verdict": verdict_info["verdict"],
                 "reproducibility_score": verdict_info["score"],
@@ -38,8 +91,9 @@ class AnalyzerAgent:
         report_path = os.path.join(
             self.reports_dir, f"{report['report_id']}.json"
         )
-        with open(report_path, "w", encoding="utf-8") as f:
-            json.dump(report, f, indent=2)
+        # Reports are consumed by the API/frontend, so they are written compact
+        with open(report_path, "wb") as f:
+            f.write(orjson.dumps(report))
 
         logger.info(f"Report saved at {report_path}")
         return report
@@ -61,35 +115,14 @@ class AnalyzerAgent:
         s1 = a1.get("status", "ERROR")
         s2 = a2.get("status", "ERROR")
 
-        # Both attempts failed hard
-        if s1 in ["ERROR", "TIMEOUT"] and s2 in ["ERROR", "TIMEOUT"]:
-            return {
-                "verdict": "ERROR",
-                "score": 0.0,
-                "notes": "Both attempts failed to execute"
-            }
+        key = (_OUTCOMES.get(s1, "OTHER"), _OUTCOMES.get(s2, "OTHER"))
+        if key == ("OTHER", "OTHER") and s1 != s2:
+            key = ("WIN", "LOSE")  # any inconsistent pair
+        verdict, score, notes, check_hash = self._VERDICT_TABLE[key]
+        notes = notes.format(s1=s1, s2=s2)
 
-        # One failed, one succeeded
-        if s1 in ["ERROR", "TIMEOUT"] or s2 in ["ERROR", "TIMEOUT"]:
-            return {
-                "verdict": "FLAKY",
-                "score": 0.5,
-                "notes": "One attempt failed, one succeeded"
-            }
-
-        # Same outcome
-        if s1 == s2:
-            if s1 == "WIN":
-                verdict = "PASS"
-                notes = "Test passed consistently"
-            elif s1 == "LOSE":
-                verdict = "FAIL"
-                notes = "Test failed consistently"
-            else:
-                verdict = "ERROR"
-                notes = "Consistent but invalid outcome"
-
-            # Optional content hash check (non-blocking)
+        # Optional content hash check (non-blocking)
+        if check_hash:
             h1 = a1.get("content_hash")
             h2 = a2.get("content_hash")
 
@@ -100,40 +133,54 @@ class AnalyzerAgent:
                 score = 0.8
                 notes += " (state variation allowed)"
 
-            return {
-                "verdict": verdict,
-                "score": score,
-                "notes": notes
-            }
-
-        # Different outcomes → flaky
         return {
-            "verdict": "FLAKY",
-            "score": 0.0,
-            "notes": f"Inconsistent results: {s1} vs {s2}"
+            "verdict": verdict,
+            "score": score,
+            "notes": notes
         }
 
     def _generate_report(self, game_info: Dict, results: List[Dict]) -> Dict:
-        timestamp = datetime.now()
-        report_id = f"report_{timestamp.strftime('%Y%m%d_%H%M%S')}"
+        # Format the instant once; report_id is sliced from the ISO string
+        timestamp = datetime.now().isoformat()
+        compact = timestamp[:19].replace("-", "").replace(":", "")
+        report_id = f"report_{compact.replace('T', '_')}"
 
-        verdicts = [r["verdict"] for r in results]
+        # One pass for verdict counts, score total and triage notes
+        counts = Counter()
+        total_score = 0.0
+        triage_notes = []
+
+        # Local bindings keep attribute lookups out of the loop
+        get = dict.get
+        notes_append = triage_notes.append
+
+        for r in results:
+            verdict = get(r, "verdict", "UNKNOWN")
+            counts[verdict] += 1
+            total_score += get(r, "reproducibility_score", 0)
+
+            if verdict in ("FAIL", "FLAKY", "ERROR"):
+                tid = get(r, "test_id", "UNKNOWN")
+                v_notes = get(r, "validation_notes", "")
+                notes_append(f"{tid} [{verdict}]: {v_notes}")
+
+        if not triage_notes:
+            triage_notes.append("No issues detected. All tests passed successfully.")
 
         summary = {
             "total_tests": len(results),
-            "passed": verdicts.count("PASS"),
-            "failed": verdicts.count("FAIL"),
-            "flaky": verdicts.count("FLAKY"),
-            "errors": verdicts.count("ERROR"),
+            "passed": counts["PASS"],
+            "failed": counts["FAIL"],
+            "flaky": counts["FLAKY"],
+            "errors": counts["ERROR"],
             "avg_reproducibility": (
-                sum(r.get("reproducibility_score", 0) for r in results) / len(results)
-                if results else 0
+                total_score / len(results) if results else 0
             )
         }
 
         return {
             "report_id": report_id,
-            "timestamp": timestamp.isoformat(),
+            "timestamp": timestamp,
             "game_url": game_info.get("url", "unknown"),
             "game_analysis": {
                 "type": game_info.get("type", "unknown"),
@@ -142,50 +189,30 @@ class AnalyzerAgent:
             },
             "summary": summary,
             "test_results": results,
-            "triage_notes": self._generate_triage_notes(results),
+            "triage_notes": triage_notes,
             "recommendations": self._generate_recommendations(summary)
         }
 
-    def _generate_triage_notes(self, results: List[Dict]) -> List[str]:
-        notes = []
-
-        for r in results:
-            tid = r.get("test_id", "UNKNOWN")
-            verdict = r.get("verdict", "UNKNOWN")
-            v_notes = r.get("validation_notes", "")
-
-            if verdict in ["FAIL", "FLAKY", "ERROR"]:
-                notes.append(f"{tid} [{verdict}]: {v_notes}")
-
-        if not notes:
-            notes.append("No issues detected. All tests passed successfully.")
+    def _generate_recommendations(self, summary: Dict) -> List[str]:
+        total = summary["total_tests"]
+        if not total:
+            return [_REC_ALL_PASSED]
 
-        return notes
+        error_ratio = summary["errors"] / total
+        flaky_ratio = summary["flaky"] / total
 
-    def _generate_recommendations(self, summary: Dict) -> List[str]:
         recs = []
 
-        if summary["errors"] > summary["total_tests"] * 0.3:
-            recs.append(
-                "High error rate detected. Consider increasing timeouts "
-                "and improving wait conditions."
-            )
+        if error_ratio > 0.3:
+            recs.append(_REC_HIGH_ERRORS)
 
-        if summary["flaky"] > summary["total_tests"] * 0.2:
-            recs.append(
-                "High flaky rate detected. Game behavior may be non-deterministic "
-                "or tests may have timing issues."
-            )
+        if flaky_ratio > 0.2:
+            recs.append(_REC_HIGH_FLAKY)
 
         if summary["failed"] > 0:
-            recs.append(
-                "Failing tests detected. Review artifacts and triage notes "
-                "for potential bugs."
-            )
+            recs.append(_REC_FAILURES)
 
-        if summary["passed"] == summary["total_tests"]:
-            recs.append(
-                "All tests passed. Consider adding more edge or stress tests."
-            )
+        if summary["passed"] == total:
+            recs.append(_REC_ALL_PASSED)
 
         return recs
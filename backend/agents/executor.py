@@ -1,35 +1,207 @@
 # backend/agents/executor.py
 
 from playwright.async_api import async_playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+import numpy as np
 import asyncio
 import os
 import hashlib
+import orjson
 import logging
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+CHROMIUM_ARGS = [
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+]
+
+# The browser visits client-supplied URLs, so the sandbox stays on unless
+# explicitly disabled (only needed when running as root in a container)
+if os.getenv("CHROMIUM_NO_SANDBOX") == "1":
+    CHROMIUM_ARGS += [
+        "--no-sandbox",
+        "--disable-setuid-sandbox",
+        "--no-zygote",
+    ]
+
+# Resource types the game UI does not need. Stylesheets are kept because
+# tile detection relies on computed opacity and layout.
+BLOCKED_RESOURCES = frozenset({"image", "media", "font"})
+
+# Counts DOM mutations (and stamps the last one) so an unchanged board can
+# skip re-scanning and waits can end once the page settles. Our own
+# data-tile-idx tagging is ignored so a scan never invalidates itself.
+MUTATION_COUNTER_JS = """
+window.__mut = 0;
+window.__mutAt = performance.now();
+new MutationObserver(records => {
+    if (records.some(r => r.attributeName !== 'data-tile-idx')) {
+        window.__mut++;
+        window.__mutAt = performance.now();
+    }
+}).observe(document, {
+    childList: true,
+    subtree: true,
+    attributes: true,
+    characterData: true
+});
+"""
+
+# Collects every active number tile in one round-trip. Candidates are tagged
+# with data-tile-idx so the chosen pair can be clicked by locator afterwards.
+# Returns null when the mutation counter still equals lastMut.
+TILE_SCAN_JS = """
+(lastMut) => {
+    const mut = window.__mut;
+    if (mut !== undefined && mut === lastMut) return null;
+    document.querySelectorAll('[data-tile-idx]')
+        .forEach(el => el.removeAttribute('data-tile-idx'));
+    const digits = /^\\d+$/;
+    const tiles = [];
+    document.querySelectorAll('div, span, button').forEach((el, i) => {
+        const text = (el.textContent || '').trim();
+        if (!digits.test(text)) return;
+        const box = el.getBoundingClientRect();
+        if (box.width < 10 || box.height < 10) return;
+        const opacity = parseFloat(getComputedStyle(el).opacity);
+        if (opacity < 0.9) return;
+        el.setAttribute('data-tile-idx', i);
+        tiles.push({
+            value: parseInt(text, 10),
+            x: box.x + box.width / 2,
+            y: box.y + box.height / 2,
+            idx: i
+        });
+    });
+    return {mut: mut === undefined ? null : mut, tiles};
+}
+"""
+
+# True once the DOM has changed at all since `prev`
+CHANGED_JS = """
+(prev) => window.__mut !== undefined && window.__mut !== prev
+"""
+
+# True once the DOM has changed since `prev` (any change if prev is null),
+# then stayed quiet for `quiet` ms with no finite CSS animation or
+# transition still running (fades do not mutate the DOM). Infinite
+# animations such as spinners are ignored so they cannot block the wait.
+SETTLED_JS = """
+([prev, quiet]) => window.__mut !== undefined
+    && (prev === null || window.__mut !== prev)
+    && performance.now() - window.__mutAt >= quiet
+    && document.getAnimations().every(a =>
+        a.playState !== 'running'
+        || a.effect.getComputedTiming().iterations === Infinity)
+"""
+
+# True once the game has drawn something clickable
+READY_JS = """
+() => document.querySelector('button, [role="button"], canvas') !== null
+"""
+
+# Clicks both tiles of a pair in one round-trip, pausing for the highlight
+# between them. Returns {mut} with the counter from just before the first
+# click, or null if either tile is gone.
+PAIR_CLICK_JS = """
+async ([first, second]) => {
+    const a = document.querySelector(`[data-tile-idx="${first}"]`);
+    const b = document.querySelector(`[data-tile-idx="${second}"]`);
+    if (!a || !b) return null;
+    const mut = window.__mut ?? null;
+    a.click();
+    await new Promise(resolve => setTimeout(resolve, 250));
+    b.click();
+    return {mut};
+}
+"""
+
+
 class ExecutorAgent:
-    def __init__(self, artifacts_dir: str = "backend/artifacts"):
+    def __init__(
+        self,
+        artifacts_dir: str = "backend/artifacts",
+        pool_size: int = 5,
+        js_clicks: bool = True,
+        browser=None
+    ):
         self.page_timeout = 15000
         self.test_timeout = 30
         self.artifacts_dir = artifacts_dir
+        # Disable for games that only react to real pointer events
+        self.js_clicks = js_clicks
         os.makedirs(self.artifacts_dir, exist_ok=True)
+        self._pw = None
+        # An injected (shared) browser is used as-is and never closed here
+        self._browser = browser
+        self._owns_browser = browser is None
+        # Caps how many attempts (browser contexts) run at once
+        self._sem = asyncio.Semaphore(pool_size)
+        # page -> (mutation counter, tiles) from the last board scan
+        self._tile_cache = {}
 
     # =====================================================
     # PUBLIC ENTRY
     # =====================================================
-    async def execute_tests(self, url: str, tests: List[Dict]) -> List[Dict]:
-        results = []
+    async def execute_tests(
+        self,
+        url: str,
+        tests: List[Dict],
+        on_progress: Optional[Callable[[Dict], None]] = None
+    ) -> List[Dict]:
+        """
+        Runs all tests; `on_progress` is called as each test finishes.
+        """
+        logger.info(f"Executing {len(tests)} tests")
+        done = 0
+
+        async def run(test: Dict) -> Dict:
+            nonlocal done
+            result = await self._execute_single_test(url, test)
+            done += 1
+            if on_progress:
+                on_progress({
+                    "test_id": test["id"],
+                    "done": done,
+                    "total": len(tests)
+                })
+            return result
 
-        for idx, test in enumerate(tests, 1):
-            logger.info(f"[{idx}/{len(tests)}] Executing {test['id']}")
-            results.append(await self._execute_single_test(url, test))
-            await asyncio.sleep(2)
+        await self._ensure_browser()
+        try:
+            results = await asyncio.gather(*[run(t) for t in tests])
+        finally:
+            await self._close_browser()
 
-        return results
+        return list(results)
+
+    # =====================================================
+    # BROWSER LIFECYCLE
+    # =====================================================
+    async def _ensure_browser(self):
+        """
+        Launches Chromium once; every attempt gets its own context.
+        """
+        if self._browser is None:
+            self._pw = await async_playwright().start()
+            self._browser = await self._pw.chromium.launch(
+                headless=True,
+                args=CHROMIUM_ARGS
+            )
+
+    async def _close_browser(self):
+        if not self._owns_browser:
+            return
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._pw is not None:
+            await self._pw.stop()
+            self._pw = None
 
     # =====================================================
     # SINGLE TEST (2 ATTEMPTS)
@@ -41,98 +213,208 @@ class ExecutorAgent:
             "steps": test.get("steps", []),
             "expected": test.get("expected", ""),
             "attempts": [],
-            "artifacts": {}
+            "artifacts": {
+                "screenshots": [],
+                "console_logs": []
+            }
         }
 
-        for attempt in (1, 2):
+        artifacts = result["artifacts"]
+        result["attempts"] = list(await asyncio.gather(
+            self._guarded_attempt(url, test, 1, artifacts),
+            self._guarded_attempt(url, test, 2, artifacts)
+        ))
+
+        return result
+
+    async def _guarded_attempt(
+        self, url: str, test: Dict, attempt: int, artifacts: Dict
+    ) -> Dict:
+        # The slot is taken before the timeout starts, so time spent
+        # queueing for a free context does not count against the attempt.
+        async with self._sem:
+            logger.info(f"Executing {test['id']} (attempt {attempt})")
             try:
-                attempt_result = await asyncio.wait_for(
-                    self._run_attempt(url, test, attempt),
+                return await asyncio.wait_for(
+                    self._run_attempt(url, test, attempt, artifacts),
                     timeout=self.test_timeout
                 )
-                result["attempts"].append(attempt_result)
             except Exception as e:
-                result["attempts"].append({
+                return {
                     "attempt": attempt,
                     "status": "ERROR",
                     "error": str(e)
-                })
-
-        result["artifacts"] = self._collect_artifacts(test["id"])
-        return result
+                }
 
     # =====================================================
     # RUN ONE ATTEMPT
     # =====================================================
-    async def _run_attempt(self, url: str, test: Dict, attempt: int) -> Dict:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page(viewport={"width": 1280, "height": 720})
-
-            try:
-                await page.goto(url, timeout=self.page_timeout, wait_until="networkidle")
-                await asyncio.sleep(1)
-
-                # Language selection (if present)
-                await self._select_english(page)
-
-                # Tutorial / gameplay uses same logic
-                for _ in range(12):
+    async def _run_attempt(
+        self, url: str, test: Dict, attempt: int, artifacts: Dict
+    ) -> Dict:
+        """
+        Runs one attempt; artifact paths are appended to `artifacts`
+        as soon as they are written.
+        """
+        context = await self._browser.new_context(
+            viewport={"width": 1280, "height": 720}
+        )
+        page = None
+        log_file = None
+        # Everything after new_context() is inside the try, so a failure
+        # or timeout here never leaves a context open on the shared browser
+        try:
+            await context.route("**/*", self._block_heavy_resources)
+            await context.add_init_script(MUTATION_COUNTER_JS)
+            page = await context.new_page()
+
+            # Console messages are streamed as NDJSON so they survive timeouts
+            log_path = self._artifact_path(
+                test["id"], attempt, "console.ndjson"
+            )
+            log_file = open(log_path, "wb", buffering=1 << 16)
+            artifacts["console_logs"].append(log_path)
+            page.on("console", lambda msg: log_file.write(
+                orjson.dumps({"type": msg.type, "text": msg.text}) + b"\n"
+            ))
+
+            await page.goto(
+                url, timeout=self.page_timeout, wait_until="domcontentloaded"
+            )
+            await self._wait_for_ready(page)
+
+            # Language selection (if present)
+            await self._select_english(page)
+
+            # Tutorial / gameplay uses same logic
+            for _ in range(12):
+                moved = await self._play_one_valid_move(page)
+                if not moved and not await self._press_plus(page):
+                    break
+
+            start_png = self._artifact_path(test["id"], attempt, "start.png")
+            await page.screenshot(path=start_png)
+            artifacts["screenshots"].append(start_png)
+
+            for step in test.get("steps", []):
+                if any(w in step.lower() for w in ["play", "match", "click"]):
                     moved = await self._play_one_valid_move(page)
                     if not moved:
-                        plus = await page.query_selector("button:has-text('+')")
-                        if plus:
-                            await plus.click()
-                            await page.wait_for_timeout(800)
-                        else:
-                            break
-
-                start_png = self._artifact_path(test["id"], attempt, "start.png")
-                await page.screenshot(path=start_png)
-
-                for step in test.get("steps", []):
-                    if any(w in step.lower() for w in ["play", "match", "click"]):
-                        moved = await self._play_one_valid_move(page)
-                        if not moved:
-                            plus = await page.query_selector("button:has-text('+')")
-                            if plus:
-                                await plus.click()
-                                await page.wait_for_timeout(800)
-                    elif "wait" in step.lower():
-                        await page.wait_for_timeout(1000)
-
-                end_png = self._artifact_path(test["id"], attempt, "end.png")
-                await page.screenshot(path=end_png)
-
-                html = await page.content()
-                content_hash = hashlib.md5(html.encode()).hexdigest()
-
-                return {
-                    "attempt": attempt,
-                    "status": "PASS",
-                    "content_hash": content_hash,
-                    "screenshots": {
-                        "start": start_png,
-                        "end": end_png
-                    }
+                        await self._press_plus(page)
+                elif "wait" in step.lower():
+                    await page.wait_for_timeout(1000)
+
+            end_png = self._artifact_path(test["id"], attempt, "end.png")
+            await page.screenshot(path=end_png)
+            artifacts["screenshots"].append(end_png)
+
+            html = await page.content()
+            content_hash = hashlib.blake2b(
+                html.encode("utf-8"), digest_size=16
+            ).hexdigest()
+
+            return {
+                "attempt": attempt,
+                "status": "PASS",
+                "content_hash": content_hash,
+                "screenshots": {
+                    "start": start_png,
+                    "end": end_png
                 }
-
-            finally:
-                await browser.close()
+            }
+
+        finally:
+            if page is not None:
+                self._tile_cache.pop(page, None)
+            await context.close()
+            if log_file is not None:
+                log_file.close()
+
+    @staticmethod
+    async def _block_heavy_resources(route):
+        if route.request.resource_type in BLOCKED_RESOURCES:
+            await route.abort()
+        else:
+            await route.continue_()
 
     # =====================================================
     # LANGUAGE SELECTION
     # =====================================================
     async def _select_english(self, page):
         try:
-            btn = await page.query_selector("button:has-text('English')")
-            if btn:
+            btn = page.locator("button:has-text('English'):visible").first
+            if await btn.count():
                 logger.info("Selecting English language")
+                prev = await self._current_mutation(page)
                 await btn.click()
-                await page.wait_for_timeout(1500)
+                await self._wait_for_settle(page, prev, 1500)
         except:
             pass
 
+    async def _press_plus(self, page) -> bool:
+        """
+        Clicks the visible '+' (add tiles) button.
+        Returns False if there is none.
+        """
+        # :visible skips hidden matches, which would otherwise make
+        # click() wait for actionability until the attempt times out
+        plus = page.locator("button:has-text('+'):visible").first
+        if not await plus.count():
+            return False
+
+        # Read live: the scan cache is empty after a failed move
+        prev = await self._current_mutation(page)
+        await plus.click()
+        await self._wait_for_settle(page, prev, 800)
+        return True
+
+    # =====================================================
+    # WAIT HELPERS
+    # =====================================================
+    async def _wait_for_ready(self, page):
+        """
+        Waits (bounded) for the load event and for the game to render a
+        control, then for the DOM to settle. Games that boot from async
+        scripts or fetches are otherwise scanned before they draw.
+        """
+        try:
+            await page.wait_for_load_state("load", timeout=5000)
+            await page.wait_for_function(READY_JS, timeout=5000)
+        except PlaywrightTimeoutError:
+            pass
+        await self._wait_for_settle(page, None, 1000)
+
+    async def _wait_for_settle(self, page, prev, timeout_ms: int):
+        """
+        Waits until the DOM has changed since `prev` and gone quiet,
+        giving up after `timeout_ms` (the old fixed pad) either way.
+        """
+        try:
+            await page.wait_for_function(
+                SETTLED_JS, arg=[prev, 100], timeout=timeout_ms
+            )
+        except PlaywrightTimeoutError:
+            pass
+
+    async def _wait_for_change(self, page, prev, timeout_ms: int) -> bool:
+        """
+        Returns True once the DOM has mutated since `prev`,
+        False if nothing changed within `timeout_ms`.
+        """
+        try:
+            await page.wait_for_function(
+                CHANGED_JS, arg=prev, timeout=timeout_ms
+            )
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    async def _current_mutation(self, page):
+        """
+        Live mutation counter, taken just before an action.
+        """
+        return await page.evaluate("window.__mut ?? null")
+
     # =====================================================
     # CORE GAME LOGIC (FINAL)
     # =====================================================
@@ -142,67 +424,90 @@ class ExecutorAgent:
         Returns True if a pair was played, False if no valid pair exists.
         """
 
-        elements = await page.query_selector_all("div, span, button")
-        tiles = []
+        # Collect ACTIVE tiles only (single in-page pass)
+        try:
+            tiles = await self._scan_tiles(page)
+        except Exception:
+            return False
 
-        # Collect ACTIVE tiles only
-        for el in elements:
-            try:
-                text = (await el.text_content() or "").strip()
-                if not text.isdigit():
-                    continue
+        if len(tiles) < 2:
+            return False
 
-                box = await el.bounding_box()
-                if not box or box["width"] < 10 or box["height"] < 10:
-                    continue
+        best_pair = self._closest_valid_pair(tiles)
 
-                opacity = await el.evaluate(
-                    "el => window.getComputedStyle(el).opacity"
-                )
-                if opacity and float(opacity) < 0.9:
-                    continue  # inactive tile
-
-                tiles.append({
-                    "el": el,
-                    "value": int(text),
-                    "x": box["x"] + box["width"] / 2,
-                    "y": box["y"] + box["height"] / 2
-                })
-            except:
-                continue
+        if best_pair:
+            first, second = best_pair
 
-        if len(tiles) < 2:
-            return False
+            if self.js_clicks:
+                clicked = await page.evaluate(PAIR_CLICK_JS, [first, second])
+                if clicked is None:
+                    # A tile vanished since the scan; rescan on the next move
+                    self._tile_cache.pop(page, None)
+                    return False
+                # Compare against the counter from just before the clicks;
+                # allow 500ms so a slow reaction is not clicked twice
+                prev = clicked["mut"]
+                js_worked = await self._wait_for_change(page, prev, 500)
+            else:
+                js_worked = False
+
+            # Games that ignore synthetic el.click() need real pointer clicks
+            if not js_worked:
+                prev = await self._current_mutation(page)
+                try:
+                    await page.locator(f'[data-tile-idx="{first}"]').click(
+                        timeout=2000
+                    )
+                    await page.wait_for_timeout(250)  # blue highlight
+                    await page.locator(f'[data-tile-idx="{second}"]').click(
+                        timeout=2000
+                    )
+                except PlaywrightTimeoutError:
+                    self._tile_cache.pop(page, None)
+                    return False
+
+            await self._wait_for_settle(page, prev, 500)
+            return True
 
-        best_pair = None
-        best_dist = float("inf")
+        return False
 
-        # Find valid (A, B) pairs
-        for i, a in enumerate(tiles):
-            for j, b in enumerate(tiles):
-                if i == j:
-                    continue
+    async def _scan_tiles(self, page) -> List[Dict]:
+        """
+        Returns the active tiles, reusing the last scan if the DOM
+        has not mutated since.
+        """
+        cached = self._tile_cache.get(page)
+        last_mut = cached[0] if cached else None
 
-                if not (a["value"] == b["value"] or a["value"] + b["value"] == 10):
-                    continue
+        scan = await page.evaluate(TILE_SCAN_JS, last_mut)
+        if scan is None:
+            return cached[1]
 
-                dx = a["x"] - b["x"]
-                dy = a["y"] - b["y"]
-                dist = (dx * dx + dy * dy) ** 0.5
+        self._tile_cache[page] = (scan["mut"], scan["tiles"])
+        return scan["tiles"]
 
-                if dist < best_dist:
-                    best_dist = dist
-                    best_pair = (a["el"], b["el"])
+    @staticmethod
+    def _closest_valid_pair(tiles: List[Dict]):
+        """
+        Returns the (idx, idx) of the closest pair whose values are equal
+        or sum to 10, or None if no such pair exists.
+        """
+        vals = np.array([t["value"] for t in tiles])
+        xs = np.array([t["x"] for t in tiles])
+        ys = np.array([t["y"] for t in tiles])
 
-        if best_pair:
-            first, second = best_pair
-            await first.click()
-            await page.wait_for_timeout(250)  # blue highlight
-            await second.click()
-            await page.wait_for_timeout(500)
-            return True
+        same = vals[:, None] == vals[None, :]
+        sum10 = (vals[:, None] + vals[None, :]) == 10
+        valid = (same | sum10) & ~np.eye(len(tiles), dtype=bool)
 
-        return False
+        d2 = (xs[:, None] - xs[None, :]) ** 2 + (ys[:, None] - ys[None, :]) ** 2
+        d2 = np.where(valid, d2, np.inf)
+
+        i, j = np.unravel_index(np.argmin(d2), d2.shape)
+        if np.isinf(d2[i, j]):
+            return None
+
+        return tiles[i]["idx"], tiles[j]["idx"]
 
     # =====================================================
     # ARTIFACT HELPERS
@@ -212,17 +517,3 @@ class ExecutorAgent:
             self.artifacts_dir,
             f"{test_id}_attempt{attempt}_{name}"
         )
-
-    def _collect_artifacts(self, test_id: str) -> Dict:
-        artifacts = {
-            "screenshots": [],
-            "console_logs": []
-        }
-
-        for f in os.listdir(self.artifacts_dir):
-            if f.startswith(test_id):
-                path = os.path.join(self.artifacts_dir, f)
-                if f.endswith(".png"):
-                    artifacts["screenshots"].append(path)
-
-        return artifacts
@@ -1,20 +1,47 @@
 # backend/agents/game_analyzer.py
 
 from playwright.async_api import async_playwright
-import ollama
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+import httpx
 import base64
-import json
+import re
+import orjson
 import asyncio
-from typing import Dict
+from typing import Dict, MutableMapping, Optional, Tuple
 import logging
 
+from agents.ollama_client import ollama_post
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# First {...} block in the reply, with or without ```json fences around it
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+# Returned when the vision model fails; never cached
+_VISION_FALLBACK = {
+    "type": "puzzle game",
+    "rules": "Interact with elements to solve the puzzle",
+    "win_condition": "Reach the game objective"
+}
+
 
 class GameAnalyzerAgent:
-    def __init__(self, vision_model: str = "llava:7b"):
+    def __init__(
+        self,
+        vision_model: str = "llava:7b",
+        browser=None,
+        cache: Optional[MutableMapping] = None,
+        ollama_client: Optional[httpx.AsyncClient] = None
+    ):
         self.vision_model = vision_model
+        # Optional shared Playwright Browser; each analysis gets its own context
+        self.browser = browser
+        # (url, vision_model) -> game info; pass a shared mapping to reuse
+        # results across agent instances
+        self._cache = {} if cache is None else cache
+        # Optional shared keep-alive client for the Ollama HTTP API
+        self.ollama_client = ollama_client
         self.page_timeout = 15000  # 15 seconds
 
     async def analyze_game(self, url: str) -> Dict:
@@ -23,14 +50,19 @@ class GameAnalyzerAgent:
         - Uses vision model for game understanding
         - Uses Playwright for high-level UI capability detection
         """
+        key = (url, self.vision_model)
+        cached = self._cache.get(key)
+        if cached is not None:
+            logger.info(f"Using cached analysis for {url}")
+            return dict(cached)
+
         logger.info(f"Analyzing game at {url}")
 
         try:
-            screenshot = await self._capture_screenshot(url)
+            screenshot, ui_capabilities = await self._load_and_probe(url)
             game_understanding = await self._analyze_with_vision(screenshot)
-            ui_capabilities = await self._detect_ui_capabilities(url)
 
-            return {
+            game_info = {
                 "url": url,
                 "type": game_understanding.get("type", "unknown"),
                 "rules": game_understanding.get("rules", "No rules extracted"),
@@ -39,6 +71,9 @@ class GameAnalyzerAgent:
                 ),
                 "ui_capabilities": ui_capabilities
             }
+            if game_understanding is not _VISION_FALLBACK:
+                self._cache[key] = dict(game_info)
+            return game_info
 
         except Exception as e:
             logger.error(f"Game analysis failed: {e}")
@@ -50,25 +85,62 @@ class GameAnalyzerAgent:
                 "ui_capabilities": {}
             }
 
-    async def _capture_screenshot(self, url: str) -> bytes:
+    async def _load_and_probe(self, url: str) -> Tuple[bytes, Dict]:
+        """
+        Loads the page once and returns (screenshot, UI capabilities).
+        Uses the shared browser when one was injected.
+        """
+        if self.browser is not None:
+            return await self._probe_page(self.browser, url)
+
         async with async_playwright() as p:
             browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context(
-                viewport={"width": 1280, "height": 720}
-            )
-            page = await context.new_page()
-
             try:
-                await page.goto(
-                    url,
-                    timeout=self.page_timeout,
-                    wait_until="networkidle"
-                )
-                await asyncio.sleep(2)
-                return await page.screenshot(full_page=False)
+                return await self._probe_page(browser, url)
             finally:
                 await browser.close()
 
+    async def _probe_page(self, browser, url: str) -> Tuple[bytes, Dict]:
+        """
+        Capabilities are high-level only: no selectors, no element metadata.
+        """
+        context = await browser.new_context(
+            viewport={"width": 1280, "height": 720}
+        )
+
+        try:
+            page = await context.new_page()
+            await page.goto(
+                url,
+                timeout=self.page_timeout,
+                wait_until="domcontentloaded"
+            )
+            # Give subresources a bounded chance to finish; slow or
+            # never-idle sites are probed as they are
+            try:
+                await page.wait_for_load_state("load", timeout=5000)
+            except PlaywrightTimeoutError:
+                pass
+
+            screenshot, button, input_el, canvas, grid = await asyncio.gather(
+                # JPEG keeps the base64 payload sent to the VLM small
+                page.screenshot(full_page=False, type="jpeg", quality=70),
+                page.query_selector("button"),
+                page.query_selector("input"),
+                page.query_selector("canvas"),
+                page.query_selector('[class*="grid"], [id*="grid"]')
+            )
+
+            return screenshot, {
+                "has_buttons": bool(button),
+                "has_inputs": bool(input_el),
+                "has_canvas": bool(canvas),
+                "has_grid_like_ui": bool(grid)
+            }
+
+        finally:
+            await context.close()
+
     async def _analyze_with_vision(self, screenshot_bytes: bytes) -> Dict:
         image_b64 = base64.b64encode(screenshot_bytes).decode()
 
@@ -89,63 +161,28 @@ Return exactly:
 """
 
         try:
-            response = ollama.chat(
-                model=self.vision_model,
-                messages=[{
+            response = await ollama_post(self.ollama_client, "/api/chat", {
+                "model": self.vision_model,
+                "messages": [{
                     "role": "user",
                     "content": prompt,
                     "images": [image_b64]
-                }]
-            )
+                }],
+                "format": "json",
+                "stream": False,
+                # Leaves room for a free-text "rules" field; a reply cut off
+                # mid-object fails to parse and falls back uncached
+                "options": {"num_predict": 200, "temperature": 0.0}
+            })
 
             text = response["message"]["content"]
 
-            if "```" in text:
-                text = text.split("```")[1]
+            match = _JSON_OBJECT_RE.search(text)
+            if not match:
+                raise ValueError("No JSON object in vision response")
 
-            return json.loads(text.strip())
+            return orjson.loads(match.group(0))
 
         except Exception as e:
             logger.warning(f"Vision analysis fallback used: {e}")
-            return {
-                "type": "puzzle game",
-                "rules": "Interact with elements to solve the puzzle",
-                "win_condition": "Reach the game objective"
-            }
-
-    async def _detect_ui_capabilities(self, url: str) -> Dict:
-        """
-        Detects high-level UI capabilities.
-        No selectors. No element metadata.
-        """
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-
-            try:
-                await page.goto(
-                    url,
-                    timeout=self.page_timeout,
-                    wait_until="networkidle"
-                )
-                await asyncio.sleep(2)
-
-                return {
-                    "has_buttons": bool(
-                        await page.query_selector("button")
-                    ),
-                    "has_inputs": bool(
-                        await page.query_selector("input")
-                    ),
-                    "has_canvas": bool(
-                        await page.query_selector("canvas")
-                    ),
-                    "has_grid_like_ui": bool(
-                        await page.query_selector(
-                            '[class*="grid"], [id*="grid"]'
-                        )
-                    )
-                }
-
-            finally:
-                await browser.close()
+            return _VISION_FALLBACK
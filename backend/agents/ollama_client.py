@@ -0,0 +1,31 @@
+# backend/agents/ollama_client.py
+
+import httpx
+import orjson
+from typing import Dict, Optional
+
+OLLAMA_URL = "http://localhost:11434"
+
+# Non-streaming calls only answer once generation finishes, so the read
+# timeout is generous; it stays finite because /api/generate-tests holds
+# the session lock across the call. A dead server still fails fast.
+OLLAMA_TIMEOUT = httpx.Timeout(connect=5.0, read=600.0, write=30.0, pool=30.0)
+
+
+async def ollama_post(
+    client: Optional[httpx.AsyncClient], path: str, payload: Dict
+) -> Dict:
+    """POST a JSON payload to Ollama and return the decoded reply.
+
+    Uses the shared `client` when given, otherwise a one-off client.
+    """
+    if client is not None:
+        response = await client.post(path, json=payload)
+    else:
+        async with httpx.AsyncClient(
+            base_url=OLLAMA_URL, timeout=OLLAMA_TIMEOUT
+        ) as one_off:
+            response = await one_off.post(path, json=payload)
+
+    response.raise_for_status()
+    return orjson.loads(response.content)
@@ -1,44 +1,111 @@
 # backend/agents/planner.py
 
-from langchain.prompts import PromptTemplate
-from langchain_community.llms import Ollama
-from langchain.chains import LLMChain
-import json
+import httpx
+import numpy as np
+import orjson
 import os
-from typing import List, Dict
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import List, Dict, Optional
 import logging
 
+from agents.ollama_client import ollama_post
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PROMPT_TEMPLATE = """Generate exactly 20 test cases for this game.
+
+Game Type: {game_type}
+Rules: {rules}
+Win Condition: {win_condition}
+
+Rules:
+- Each test must have 3–5 steps max
+- Categories:
+  Happy Path (6)
+  Edge Case (6)
+  Invalid Input (4)
+  Stress Test (4)
+- Priority is one of HIGH, MEDIUM, LOW
+
+Respond ONLY with JSON of this exact shape:
+{{"tests": [{{"id": "TEST_01", "category": "Happy Path", "priority": "HIGH", "steps": ["step1", "step2", "step3"], "expected": "expected result"}}]}}
+
+Generate TEST_01 through TEST_20."""
+
+
+def _empty_memory() -> Dict:
+    return {
+        "successful_tests": [],
+        "failed_patterns": []
+    }
+
+
+@lru_cache(maxsize=1)
+def _read_memory(path: str, mtime_ns: int, size: int) -> Dict:
+    """
+    Parses the JSONL memory log. Keyed on mtime and size so the cached
+    copy is dropped as soon as the file changes.
+    """
+    memory = _empty_memory()
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            memory.setdefault(record["bucket"], []).append(record["entry"])
+    return memory
+
+
+# Test ids become artifact file names, so only the prompted range is kept
+_TEST_ID_RE = re.compile(r"TEST_(0[1-9]|1\d|20)")
+
+CATEGORIES = ("Happy Path", "Edge Case", "Invalid Input", "Stress Test")
+PRIORITIES = ("HIGH", "MEDIUM", "LOW")
+
+PRIORITY_SCORES = {"HIGH": 10, "MEDIUM": 5, "LOW": 2}
+CATEGORY_SCORES = {
+    "Happy Path": 8,
+    "Edge Case": 7,
+    "Invalid Input": 6,
+    "Stress Test": 5
+}
+
 
 class PlannerAgent:
-    def __init__(self, memory_file: str = "backend/memory/history.json"):
-        self.llm = Ollama(model="llama3.2:3b", temperature=0.7)
+    def __init__(
+        self,
+        memory_file: str = "backend/memory/history.jsonl",
+        ollama_client: Optional[httpx.AsyncClient] = None
+    ):
+        self.model = "llama3.2:3b"
+        # Optional shared keep-alive client for the Ollama HTTP API
+        self.ollama_client = ollama_client
         self.memory_file = memory_file
         self._ensure_memory_exists()
 
     def _ensure_memory_exists(self):
         os.makedirs(os.path.dirname(self.memory_file), exist_ok=True)
         if not os.path.exists(self.memory_file):
-            with open(self.memory_file, "w", encoding="utf-8") as f:
-                json.dump(
-                    {
-                        "successful_tests": [],
-                        "failed_patterns": []
-                    },
-                    f,
-                    indent=2
-                )
-
-    def generate_and_rank_tests(self, game_info: Dict) -> List[Dict]:
+            open(self.memory_file, "a", encoding="utf-8").close()
+
+    async def generate_and_rank_tests(self, game_info: Dict) -> List[Dict]:
         logger.info(f"Generating tests for {game_info.get('type', 'unknown')}")
 
         memory = self._load_memory()
-        tests = self._generate_tests(game_info, memory)
+        tests = await self._generate_tests(game_info, memory)
 
+        # Padding must not reuse a model-supplied id: ids name artifacts
+        taken = {t["id"] for t in tests}
+        num = 0
         while len(tests) < 20:
-            tests.append(self._create_fallback_test(len(tests) + 1))
+            num += 1
+            fallback = self._create_fallback_test(num)
+            if fallback["id"] not in taken:
+                taken.add(fallback["id"])
+                tests.append(fallback)
 
         ranked = self._rank_tests(tests)
         top_10 = self._select_diverse_top_tests(ranked, limit=10)
@@ -46,101 +113,113 @@ class PlannerAgent:
         logger.info("Generated 20 tests, selected diverse top 10")
         return top_10
 
-    def _generate_tests(self, game_info: Dict, memory: Dict) -> List[Dict]:
-        prompt = PromptTemplate(
-            input_variables=["game_type", "rules", "win_condition"],
-            template="""Generate exactly 20 test cases for this game.
-
-Game Type: {game_type}
-Rules: {rules}
-Win Condition: {win_condition}
-
-Rules:
-- Each test must have 3–5 steps max
-- Categories:
-  Happy Path (6)
-  Edge Case (6)
-  Invalid Input (4)
-  Stress Test (4)
-
-Format EXACTLY:
-TEST_01|Happy Path|HIGH|step1 > step2 > step3|expected result
-
-Generate TEST_01 through TEST_20:"""
+    async def _generate_tests(self, game_info: Dict, memory: Dict) -> List[Dict]:
+        prompt = PROMPT_TEMPLATE.format(
+            game_type=game_info.get("type", "game"),
+            rules=game_info.get("rules", ""),
+            win_condition=game_info.get("win_condition", "")
         )
 
         try:
-            chain = LLMChain(llm=self.llm, prompt=prompt)
-            output = chain.run(
-                game_type=game_info.get("type", "game"),
-                rules=game_info.get("rules", ""),
-                win_condition=game_info.get("win_condition", "")
-            )
-            return self._parse_tests(output)
+            # JSON mode makes the model emit structurally valid output
+            response = await ollama_post(self.ollama_client, "/api/generate", {
+                "model": self.model,
+                "prompt": prompt,
+                "format": "json",
+                "stream": False,
+                # 20 JSON tests fit well under this; it only cuts off rambling
+                "options": {"temperature": 0.7, "num_predict": 2048}
+            })
+            return self._parse_tests(response["response"])
         except Exception as e:
             logger.error(f"LLM generation failed: {e}")
             return [self._create_fallback_test(i) for i in range(1, 21)]
 
     def _parse_tests(self, text: str) -> List[Dict]:
         tests = []
-        for line in text.splitlines():
-            if not line.strip().startswith("TEST_"):
+        seen_ids = set()
+        for item in orjson.loads(text).get("tests", []):
+            if not isinstance(item, dict):
                 continue
 
-            parts = [p.strip() for p in line.split("|")]
-            if len(parts) < 5:
-                continue
+            test_id = str(item.get("id") or "")
+            if not _TEST_ID_RE.fullmatch(test_id):
+                test_id = None  # renumbered below
+            elif test_id in seen_ids:
+                continue  # models sometimes repeat a test verbatim
+            else:
+                seen_ids.add(test_id)
+
+            steps = item.get("steps", [])
+            if isinstance(steps, str):
+                steps = steps.split(">")
 
             tests.append({
-                "id": parts[0],
-                "category": parts[1],
-                "priority": parts[2],
-                "steps": [s.strip() for s in parts[3].split(">")],
-                "expected": parts[4],
+                "id": test_id,
+                "category": str(item.get("category", "")),
+                "priority": str(item.get("priority", "")).upper(),
+                "steps": [str(s).strip() for s in steps],
+                "expected": str(item.get("expected", "")),
                 "score": 0
             })
 
+            if len(tests) == 20:
+                break
+
+        # At most 20 tests, so a free TEST_NN always remains
+        free = (
+            f"TEST_{n:02d}" for n in range(1, 21)
+            if f"TEST_{n:02d}" not in seen_ids
+        )
+        for t in tests:
+            if t["id"] is None:
+                t["id"] = next(free)
+
         return tests
 
     def _create_fallback_test(self, num: int) -> Dict:
-        categories = ["Happy Path", "Edge Case", "Invalid Input", "Stress Test"]
-        priorities = ["HIGH", "MEDIUM", "LOW"]
-
         return {
             "id": f"TEST_{num:02d}",
-            "category": categories[num % 4],
-            "priority": priorities[num % 3],
+            "category": CATEGORIES[num % 4],
+            "priority": PRIORITIES[num % 3],
             "steps": ["Open game", "Perform action", "Check result"],
             "expected": "Should behave correctly",
             "score": 0
         }
 
     def _rank_tests(self, tests: List[Dict]) -> List[Dict]:
-        for t in tests:
-            score = 0
-            score += {"HIGH": 10, "MEDIUM": 5, "LOW": 2}.get(t["priority"], 2)
-            score += {
-                "Happy Path": 8,
-                "Edge Case": 7,
-                "Invalid Input": 6,
-                "Stress Test": 5
-            }.get(t["category"], 3)
-            score += min(len(t["steps"]), 5)
+        n = len(tests)
+        priorities = np.fromiter(
+            (PRIORITY_SCORES.get(t["priority"], 2) for t in tests),
+            dtype=np.int8, count=n
+        )
+        categories = np.fromiter(
+            (CATEGORY_SCORES.get(t["category"], 3) for t in tests),
+            dtype=np.int8, count=n
+        )
+        steps = np.fromiter(
+            (min(len(t["steps"]), 5) for t in tests),
+            dtype=np.int8, count=n
+        )
+        scores = priorities + categories + steps
+
+        for t, score in zip(tests, scores.tolist()):
             t["score"] = score
 
-        return sorted(tests, key=lambda x: x["score"], reverse=True)
+        # Stable sort keeps LLM order for ties, like sorted(reverse=True)
+        return [tests[i] for i in np.argsort(-scores, kind="stable")]
 
     def _select_diverse_top_tests(self, tests: List[Dict], limit: int) -> List[Dict]:
         selected = []
-        category_count = {}
+        category_count: defaultdict[str, int] = defaultdict(int)
 
         for t in tests:
             cat = t["category"]
-            if category_count.get(cat, 0) >= 4:
+            if category_count[cat] >= 4:
                 continue
 
             selected.append(t)
-            category_count[cat] = category_count.get(cat, 0) + 1
+            category_count[cat] += 1
 
             if len(selected) == limit:
                 break
@@ -148,11 +227,12 @@ Generate TEST_01 through TEST_20:"""
         return selected
 
     def _load_memory(self) -> Dict:
+        """
+        Returns the (shared, read-only) memory; only re-parsed when the
+        log file has changed.
+        """
         try:
-            with open(self.memory_file, "r", encoding="utf-8") as f:
-                return json.load(f)
+            st = os.stat(self.memory_file)
+            return _read_memory(self.memory_file, st.st_mtime_ns, st.st_size)
         except Exception:
-            return {
-                "successful_tests": [],
-                "failed_patterns": []
-            }
+            return _empty_memory()
@@ -2,26 +2,65 @@
 
 from fastapi import FastAPI, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, HttpUrl
+from playwright.async_api import async_playwright
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
+from pathlib import Path
+from uuid import uuid4
+import httpx
 import asyncio
+import orjson
 import os
 import sys
 import logging
+from typing import Dict, Set, Tuple
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from agents.game_analyzer import GameAnalyzerAgent
 from agents.planner import PlannerAgent
-from agents.executor import ExecutorAgent
+from agents.executor import ExecutorAgent, CHROMIUM_ARGS
 from agents.analyzer import AnalyzerAgent
+from agents.ollama_client import OLLAMA_URL, OLLAMA_TIMEOUT
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Resolved once; served files must stay inside these directories
+REPORTS_DIR = Path("backend/reports").resolve()
+ARTIFACTS_DIR = Path("backend/artifacts").resolve()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One Chromium for the whole process; requests open their own contexts
+    pw = await async_playwright().start()
+    app.state.browser = await pw.chromium.launch(
+        headless=True,
+        args=CHROMIUM_ARGS
+    )
+    # Successful game analyses keyed by (url, vision_model)
+    app.state.analysis_cache = TTLCache(maxsize=128, ttl=3600)
+    # Keep-alive connection pool to Ollama shared by all agents
+    app.state.ollama = httpx.AsyncClient(
+        base_url=OLLAMA_URL,
+        timeout=OLLAMA_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=8)
+    )
+    try:
+        yield
+    finally:
+        await app.state.ollama.aclose()
+        await app.state.browser.close()
+        await pw.stop()
+
+
 app = FastAPI(
     title="Multi-Agent Game Tester POC",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -41,8 +80,47 @@ class AppState:
         self.game_info = None
         self.tests = None
         self.report = None
+        # Guards the generate -> execute handoff within one session
+        self.lock = asyncio.Lock()
+        # One queue per /api/events subscriber; events go to all of them
+        self.subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event: Dict):
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def set_status(self, status: str):
+        self.status = status
+        self.publish(self.status_event())
+
+    def status_event(self) -> Dict:
+        return {
+            "event": "status",
+            "status": self.status,
+            "report": self.report if self.status == "completed" else None
+        }
+
+
+# session_id -> AppState. TTLCache times entries from their last write,
+# so get_session re-stores each hit: a session expires an hour after it
+# was last used, and LRU eviction at maxsize drops the least recently used
+SESSIONS: TTLCache = TTLCache(maxsize=1000, ttl=3600)
+
 
-state = AppState()
+def get_session(session_id: str) -> AppState:
+    state = SESSIONS.get(session_id)
+    if state is None:
+        raise HTTPException(404, "Unknown or expired session")
+    SESSIONS[session_id] = state
+    return state
 
 
 @app.get("/")
@@ -50,27 +128,63 @@ async def root():
     return {"status": "online", "service": "Game Tester POC"}
 
 
+def new_game_analyzer() -> GameAnalyzerAgent:
+    return GameAnalyzerAgent(
+        browser=app.state.browser,
+        cache=app.state.analysis_cache,
+        ollama_client=app.state.ollama
+    )
+
+
+def new_planner() -> PlannerAgent:
+    return PlannerAgent(ollama_client=app.state.ollama)
+
+
+def create_session() -> Tuple[str, AppState]:
+    session_id = uuid4().hex
+    state = AppState()
+    SESSIONS[session_id] = state
+    return session_id, state
+
+
+async def run_analysis(state: AppState, url: str):
+    state.status = "analyzing"
+    state.game_info = await new_game_analyzer().analyze_game(url)
+    state.status = "analyzed"
+
+
+async def run_planning(state: AppState):
+    state.tests = await new_planner().generate_and_rank_tests(state.game_info)
+    state.status = "tests_generated"
+
+
 @app.post("/api/analyze")
 async def analyze_game(req: GameRequest):
+    session_id, state = create_session()
+
     try:
-        state.status = "analyzing"
-        analyzer = GameAnalyzerAgent()
-        state.game_info = await analyzer.analyze_game(str(req.url))
-        state.status = "analyzed"
-        return {"status": "success", "game_info": state.game_info}
+        await run_analysis(state, str(req.url))
+        return {
+            "status": "success",
+            "session_id": session_id,
+            "game_info": state.game_info
+        }
     except Exception as e:
         state.status = "error"
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/generate-tests")
-async def generate_tests():
+async def generate_tests(session_id: str):
+    state = get_session(session_id)
     if not state.game_info:
         raise HTTPException(400, "Analyze game first")
 
-    planner = PlannerAgent()
-    state.tests = planner.generate_and_rank_tests(state.game_info)
-    state.status = "tests_generated"
+    async with state.lock:
+        if state.status == "executing":
+            raise HTTPException(409, "Tests are already executing")
+
+        await run_planning(state)
 
     return {
         "status": "success",
@@ -79,26 +193,58 @@ async def generate_tests():
     }
 
 
+@app.post("/api/analyze-and-plan")
+async def analyze_and_plan(req: GameRequest):
+    """
+    /api/analyze then /api/generate-tests in one request. The two steps
+    still run one after the other; the only saving is one client round-trip.
+    """
+    session_id, state = create_session()
+
+    try:
+        # The session id has not been returned yet, so nothing else can
+        # reach this state and the per-session lock is not needed
+        await run_analysis(state, str(req.url))
+        await run_planning(state)
+        return {
+            "status": "success",
+            "session_id": session_id,
+            "game_info": state.game_info,
+            "test_count": len(state.tests),
+            "tests": state.tests
+        }
+    except Exception as e:
+        state.status = "error"
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/execute-tests")
-async def execute_tests(background_tasks: BackgroundTasks):
+async def execute_tests(session_id: str, background_tasks: BackgroundTasks):
+    state = get_session(session_id)
     if not state.tests:
         raise HTTPException(400, "Generate tests first")
 
-    state.status = "executing"
-    background_tasks.add_task(run_tests_background_sync)
+    async with state.lock:
+        if state.status == "executing":
+            raise HTTPException(409, "Tests are already executing")
+        state.set_status("executing")
+
+    # Async tasks run on the main event loop after the response is sent
+    background_tasks.add_task(run_tests_background, state)
 
     return {"status": "started"}
 
-def run_tests_background_sync():
-    asyncio.run(run_tests_background())
 
+async def run_tests_background(state: AppState):
+    def on_progress(progress: Dict):
+        state.publish({"event": "progress", **progress})
 
-async def run_tests_background():
     try:
-        executor = ExecutorAgent()
+        executor = ExecutorAgent(browser=app.state.browser)
         results = await executor.execute_tests(
             state.game_info["url"],
-            state.tests
+            state.tests,
+            on_progress=on_progress
         )
 
         analyzer = AnalyzerAgent()
@@ -107,16 +253,17 @@ async def run_tests_background():
             results
         )
 
-        state.status = "completed"
+        state.set_status("completed")
         logger.info("Test run completed")
 
     except Exception as e:
-        state.status = "error"
+        state.set_status("error")
         logger.error(f"Execution failed: {e}")
 
 
 @app.get("/api/status")
-async def get_status():
+async def get_status(session_id: str):
+    state = get_session(session_id)
     return {
         "status": state.status,
         "has_game_info": state.game_info is not None,
@@ -126,24 +273,54 @@ async def get_status():
     }
 
 
+@app.get("/api/events")
+async def stream_events(session_id: str):
+    """
+    Server-Sent Events feed of execution progress. Sends the current
+    status first and ends as soon as no run is executing.
+    """
+    state = get_session(session_id)
+
+    async def event_generator():
+        # Subscribe before the snapshot so no event falls in between
+        queue = state.subscribe()
+        try:
+            event = state.status_event()
+            while True:
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+                if event["event"] == "status" and event["status"] != "executing":
+                    break
+                event = await queue.get()
+        finally:
+            state.unsubscribe(queue)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
+def _resolve_inside(base: Path, name: str) -> Path:
+    target = (base / name).resolve()
+    if not target.is_relative_to(base):
+        raise HTTPException(400, "Invalid path")
+    return target
+
+
 @app.get("/reports/{report_id}")
 async def get_report_file(report_id: str):
-    path = f"backend/reports/{report_id}.json"
-    if not os.path.exists(path):
+    path = _resolve_inside(REPORTS_DIR, f"{report_id}.json")
+    if not path.is_file():
         raise HTTPException(404, "Report not found")
     return FileResponse(path, media_type="application/json")
 
 
 @app.get("/artifacts/{filename}")
 async def get_artifact(filename: str):
-    path = f"backend/artifacts/{filename}"
-    if not os.path.exists(path):
+    path = _resolve_inside(ARTIFACTS_DIR, filename)
+    if not path.is_file():
         raise HTTPException(404, "Artifact not found")
     return FileResponse(path)
 
 
 @app.post("/api/reset")
-async def reset_state():
-    global state
-    state = AppState()
+async def reset_state(session_id: str):
+    SESSIONS.pop(session_id, None)
     return {"status": "reset"}